@@ -1,7 +1,8 @@
 #!/usr/bin/python
-import enum
-import shutil
-from pathlib import Path
+import contextlib
+import os
+import stat
+from typing import Iterator
 
 from ansible.module_utils.basic import AnsibleModule
 
@@ -16,6 +17,7 @@ options:
   path:
     description:
     - Path to the file/directory.
+    - Paths pointing at a symlink are rejected.
     type: path
     required: yes
   state:
@@ -91,155 +93,276 @@ EXAMPLES = r"""
 """
 
 
-class State(enum.Enum):
-    FILE = "file"
-    DIRECTORY = "directory"
-    ABSENT = "absent"
+STATE_FILE = "file"
+STATE_DIR = "directory"
+STATE_ABSENT = "absent"
+STATE_CHOICES = (STATE_FILE, STATE_DIR, STATE_ABSENT)
 
-    @classmethod
-    def to_choices(cls) -> list:
-        return [e.value for e in cls]
+_ERR_SYMLINK = "Error, symlink rejected: {}.".format
+_ERR_LSTAT = "Error, could not inspect path: {}, error: {}.".format
+_ERR_FILE_SEP = (
+    "Error, could not create file: {}, path ends with a separator.".format
+)
+_ERR_CONFLICT = "Error, could not create {}: {}, path is {}.".format
+_ERR_TRANSITION = "Error, could not {}: {}, error: {}.".format
 
 
-def get_current_state(path: Path):
-    if path.exists():
-        if path.is_dir():
-            return State.DIRECTORY
-        return State.FILE
-    return State.ABSENT
+def get_current_state(path: str, module: AnsibleModule) -> str:
+    """Return the state of path, based on a single lstat.
 
+    Symlinks are not followed, paths pointing at a symlink are rejected.
+    """
+    try:
+        st = os.lstat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return STATE_ABSENT
+    except OSError as e:
+        module.fail_json(msg=_ERR_LSTAT(path, e))
+    if stat.S_ISLNK(st.st_mode):
+        module.fail_json(msg=_ERR_SYMLINK(path))
+    if stat.S_ISDIR(st.st_mode):
+        return STATE_DIR
+    return STATE_FILE
 
-def init_diff(path: str, next_state: State, current_state: State) -> dict:
+
+def init_diff(path: str, next_state: str, current_state: str) -> dict:
     diff = {
         "before": {"path": path},
         "after": {"path": path},
     }
 
     if current_state != next_state:
-        diff["before"]["state"] = current_state.value
-        diff["after"]["state"] = next_state.value
+        diff["before"]["state"] = current_state
+        diff["after"]["state"] = next_state
 
     return diff
 
 
-def get_check_mode_result(diff: dict, path: str) -> dict:
-    return {"changed": True, "diff": diff, "path": path}
-
-
-def ensure_file(path: str, nested: bool, module: AnsibleModule) -> dict:
-    file = Path(path)
-    current_state = get_current_state(file)
-
-    changed = False
-    result = {"path": path}
-
-    diff = init_diff(path, State.FILE, current_state)
-
-    if current_state == State.ABSENT:
-        if module.check_mode:
-            return get_check_mode_result(diff, path)
-        try:
-            file.parent.mkdir(parents=nested, exist_ok=True)
-            file.touch()
-
-            changed = True
-        except (OSError, IOError) as e:
-            module.fail_json(
-                msg=f"Error, could not create file: {path}, error: {e}."
-            )
-    if current_state == State.DIRECTORY:
-        module.fail_json(
-            msg=f"Error, could not create file: {path}, path is directory."
+def get_result(
+    path: str,
+    changed: bool,
+    next_state: str,
+    current_state: str,
+    module: AnsibleModule,
+) -> dict:
+    if module._diff:
+        diff = init_diff(path, next_state, current_state)
+        return {"path": path, "changed": changed, "diff": diff}
+    return {"path": path, "changed": changed}
+
+
+def _sorted_entries(directory) -> Iterator[os.DirEntry]:
+    """Return an iterator over the entries of directory, sorted by name.
+
+    Unlinking siblings in name order keeps the filesystem's directory b-tree
+    from rebalancing as often as unlinking in readdir order does.
+    """
+    with os.scandir(directory) as entries:
+        return iter(sorted(entries, key=lambda entry: entry.name))
+
+
+def _iter_rmtree(path: str) -> None:
+    """Recursively delete path without recursion, using os.scandir.
+
+    Entry types come from the cached dirent, symlinks are unlinked, never
+    followed.
+    """
+    stack = [(path, _sorted_entries(path))]
+    while stack:
+        dir_path, entries = stack[-1]
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append((entry.path, _sorted_entries(entry.path)))
+                break
+            os.unlink(entry.path)
+        else:
+            stack.pop()
+            os.rmdir(dir_path)
+
+
+_DIR_OPEN_FLAGS = os.O_RDONLY | os.O_DIRECTORY | getattr(os, "O_NOFOLLOW", 0)
+_DIR_FD_SUPPORTED = (
+    os.scandir in os.supports_fd
+    and {os.open, os.unlink, os.rmdir} <= os.supports_dir_fd
+)
+_MAX_OPEN_DIR_FDS = 16
+
+
+def _open_dir(name: str, dir_fd=None) -> tuple:
+    """Open directory name and list it, the fd is closed if listing fails."""
+    fd = os.open(name, _DIR_OPEN_FLAGS, dir_fd=dir_fd)
+    try:
+        return fd, _sorted_entries(fd)
+    except BaseException:
+        os.close(fd)
+        raise
+
+
+def _fast_rmtree(path: str) -> None:
+    """Recursively delete path relative to open directory file descriptors.
+
+    Entries are unlinked by name against the fd of their parent, which spares
+    the kernel a full path walk per entry. At most _MAX_OPEN_DIR_FDS fds are
+    kept open, deeper subtrees are handed over to _iter_rmtree.
+    """
+    stack = []
+    try:
+        stack.append((*_open_dir(path), path))
+        while stack:
+            dir_fd, entries, dir_path = stack[-1]
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False):
+                    os.unlink(entry.name, dir_fd=dir_fd)
+                elif len(stack) < _MAX_OPEN_DIR_FDS:
+                    child_path = os.path.join(dir_path, entry.name)
+                    fd, child_entries = _open_dir(entry.name, dir_fd)
+                    stack.append((fd, child_entries, child_path))
+                    break
+                else:
+                    _iter_rmtree(os.path.join(dir_path, entry.name))
+            else:
+                os.close(dir_fd)
+                stack.pop()
+                if stack:
+                    os.rmdir(os.path.basename(dir_path), dir_fd=stack[-1][0])
+                else:
+                    os.rmdir(path)
+    finally:
+        for dir_fd, _, _ in stack:
+            os.close(dir_fd)
+
+
+def remove_directory(path: str, nested: bool) -> bool:
+    """Recursively delete path, preferring the native rm binary when present."""
+    import shutil
+    import subprocess
+
+    rm = shutil.which("rm")
+    if rm is None:
+        if _DIR_FD_SUPPORTED:
+            _fast_rmtree(path)
+        else:
+            _iter_rmtree(path)
+        return True
+    process = subprocess.run(
+        [rm, "-rf", "--", path], capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        raise OSError(process.stderr.strip())
+    return True
+
+
+_FILE_CREATE_FLAGS = (
+    os.O_WRONLY | os.O_CREAT | os.O_CLOEXEC | getattr(os, "O_NOFOLLOW", 0)
+)
+
+
+def create_file(path: str, nested: bool) -> bool:
+    parent = os.path.dirname(path) or os.curdir
+    if not os.path.isdir(parent):
+        if nested:
+            os.makedirs(parent, exist_ok=True)
+        else:
+            with contextlib.suppress(FileExistsError):
+                os.mkdir(parent)
+    os.close(os.open(path, _FILE_CREATE_FLAGS, 0o666))
+    return True
+
+
+def create_directory(path: str, nested: bool) -> bool:
+    """Create path, return False if something already exists there."""
+    try:
+        if nested:
+            os.makedirs(path)
+        else:
+            os.mkdir(path)
+    except FileExistsError:
+        return False
+    return True
+
+
+def remove_file(path: str, nested: bool) -> bool:
+    """Unlink path, return False if it is already gone."""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+# (current state, next state) -> (description, action). Pairs missing here
+# need no change. nested is only used by the create actions.
+_TRANSITIONS = {
+    (STATE_ABSENT, STATE_FILE): ("create file", create_file),
+    (STATE_ABSENT, STATE_DIR): ("create directory", create_directory),
+    (STATE_FILE, STATE_ABSENT): ("delete file", remove_file),
+    (STATE_DIR, STATE_ABSENT): ("delete directory", remove_directory),
+}
+_CONFLICTS = {(STATE_DIR, STATE_FILE), (STATE_FILE, STATE_DIR)}
+
+
+def apply_transition(
+    path: str,
+    current_state: str,
+    next_state: str,
+    nested: bool,
+    module: AnsibleModule,
+) -> bool:
+    """Run the action moving path from current_state to next_state.
+
+    Returns whether the filesystem was changed.
+    """
+    what, action = _TRANSITIONS[(current_state, next_state)]
+    try:
+        return action(path, nested)
+    except OSError as e:
+        module.fail_json(msg=_ERR_TRANSITION(what, path, e))
+
+
+def ensure_state(
+    path: str, next_state: str, nested: bool, module: AnsibleModule
+) -> dict:
+    """Bring path into next_state, honouring check mode.
+
+    Creating a directory is attempted straight away, the path only has to
+    be inspected when it turns out to exist already. Everything else starts
+    from a single lstat.
+    """
+    if next_state == STATE_FILE and os.fspath(path).endswith(os.sep):
+        module.fail_json(msg=_ERR_FILE_SEP(path))
+
+    if next_state == STATE_DIR and not module.check_mode:
+        if apply_transition(path, STATE_ABSENT, next_state, nested, module):
+            return get_result(path, True, next_state, STATE_ABSENT, module)
+
+    current_state = get_current_state(path, module)
+
+    if (current_state, next_state) in _CONFLICTS:
+        module.fail_json(msg=_ERR_CONFLICT(next_state, path, current_state))
+
+    changed = (current_state, next_state) in _TRANSITIONS
+    if changed and not module.check_mode:
+        changed = apply_transition(
+            path, current_state, next_state, nested, module
         )
 
-    result["changed"] = changed
-    result["diff"] = diff
-    return result
-
-
-def ensure_directory(path: str, nested: bool, module: AnsibleModule) -> dict:
-    dir = Path(path)
-    current_state = get_current_state(dir)
-
-    changed = False
-    result = {"path": path}
-
-    diff = init_diff(path, State.DIRECTORY, current_state)
-
-    if current_state == State.ABSENT:
-        if module.check_mode:
-            return get_check_mode_result(diff, path)
-        try:
-            dir.mkdir(parents=nested, exist_ok=True)
-            changed = True
-        except OSError as e:
-            module.fail_json(
-                msg=f"Error, could not create directory: {path}, error: {e}."
-            )
-
-    result["changed"] = changed
-    result["diff"] = diff
-    return result
-
-
-def ensure_absent(path: str, module: AnsibleModule) -> dict:
-    absent = Path(path)
-    current_state = get_current_state(absent)
-
-    changed = False
-    result = {"path": path}
-
-    diff = init_diff(path, State.ABSENT, current_state)
-
-    if current_state == State.DIRECTORY:
-        if module.check_mode:
-            return get_check_mode_result(diff, path)
-        try:
-            shutil.rmtree(path, ignore_errors=False)
-            changed = True
-        except Exception as e:
-            module.fail_json(
-                msg=f"Error, could not delete directory: {path}, error: {e}"
-            )
-    elif current_state == State.FILE:
-        if module.check_mode:
-            return get_check_mode_result(diff, path)
-        try:
-            absent.unlink(missing_ok=True)
-            changed = True
-        except OSError as e:
-            module.fail_json(
-                msg=f"Error, could not delete file: {path}, error: {e}"
-            )
-
-    result["changed"] = changed
-    result["diff"] = diff
-    return result
+    return get_result(path, changed, next_state, current_state, module)
 
 
 def run_proper_handler(module: AnsibleModule) -> dict:
-    result = dict(changed=False)
     params = module.params
 
     state = params["state"]
     path = params["path"]
     nested = params["nested"]
 
-    # could use match statement here
-    if state == State.FILE.value:
-        result = ensure_file(path, nested, module)
-    elif state == State.DIRECTORY.value:
-        result = ensure_directory(path, nested, module)
-    elif state == State.ABSENT.value:
-        result = ensure_absent(path, module)
-
-    return result
+    return ensure_state(path, state, nested, module)
 
 
 def run_module():
     module_args = dict(
         path=dict(type="path", required=True),
-        state=dict(type="str", choices=State.to_choices(), required=True),
+        state=dict(type="str", choices=STATE_CHOICES, required=True),
         nested=dict(type="bool", default=False),
     )
 
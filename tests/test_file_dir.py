@@ -1,6 +1,14 @@
+import os
+
 import pytest
 
-from roles.server.library.file_dir import run_proper_handler
+from roles.server.library import file_dir
+from roles.server.library.file_dir import (
+    _fast_rmtree,
+    _iter_rmtree,
+    remove_file,
+    run_proper_handler,
+)
 
 
 class FailException(Exception):
@@ -8,9 +16,10 @@ class FailException(Exception):
 
 
 class FakeModule:
-    def __init__(self, check_mode=False, **kwargs):
+    def __init__(self, check_mode=False, diff=True, **kwargs):
         self.params = kwargs
         self.check_mode = check_mode
+        self._diff = diff
 
     def fail_json(self, *args, **kwargs):
         self.exit_args = args
@@ -72,6 +81,65 @@ def test_dir_created_only_once(tmp_path):
     assert len(list(tmp_path.iterdir())) == 1
 
 
+@pytest.mark.parametrize("check_mode", [False, True])
+def test_dir_creation_fails_when_path_is_file(tmp_path, check_mode):
+    file_path = tmp_path / "file"
+    file_path.touch()
+    module = FakeModule(
+        check_mode=check_mode, path=file_path, state="directory", nested=False
+    )
+    with pytest.raises(FailException):
+        run_proper_handler(module)
+    assert file_path.is_file()
+
+
+def test_file_creation_under_symlinked_parent_skips_mkdir(
+    tmp_path, monkeypatch
+):
+    target = tmp_path / "target"
+    target.mkdir()
+    link = tmp_path / "link"
+    link.symlink_to(target)
+
+    def fail_mkdir(*args, **kwargs):
+        raise AssertionError("mkdir called")
+
+    monkeypatch.setattr(os, "mkdir", fail_mkdir)
+    module = FakeModule(path=link / "file", state="file", nested=False)
+    result = run_proper_handler(module)
+    assert result["changed"]
+    assert (target / "file").is_file()
+
+
+@pytest.mark.parametrize("check_mode", [False, True])
+def test_file_creation_with_trailing_separator_fails(tmp_path, check_mode):
+    module = FakeModule(
+        check_mode=check_mode,
+        path=f"{tmp_path / 'file'}/",
+        state="file",
+        nested=False,
+    )
+    with pytest.raises(FailException):
+        run_proper_handler(module)
+    assert len(list(tmp_path.iterdir())) == 0
+
+
+def test_file_creation_does_not_follow_planted_symlink(tmp_path, monkeypatch):
+    target = tmp_path / "target"
+    file_path = tmp_path / "file"
+
+    def lstat_then_plant(path):
+        # the path is reported absent, then a symlink appears before the open
+        file_path.symlink_to(target)
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, "lstat", lstat_then_plant)
+    module = FakeModule(path=file_path, state="file", nested=False)
+    with pytest.raises(FailException):
+        run_proper_handler(module)
+    assert not target.exists()
+
+
 def test_file_created_only_once(tmp_path):
     file_path = tmp_path / "file"
     module = FakeModule(path=file_path, state="file", nested=False)
@@ -80,6 +148,30 @@ def test_file_created_only_once(tmp_path):
     assert len(list(tmp_path.iterdir())) == 1
 
 
+def test_file_recreated_after_outside_deletion(tmp_path):
+    file_path = tmp_path / "file"
+    module = FakeModule(path=file_path, state="file", nested=False)
+    run_proper_handler(module)
+    run_proper_handler(module)
+    file_path.unlink()
+    result = run_proper_handler(module)
+    assert result["changed"]
+    assert file_path.is_file()
+
+
+def test_parent_recreated_after_outside_deletion(tmp_path):
+    dir_path = tmp_path / "nested1"
+    module = FakeModule(path=dir_path, state="directory", nested=False)
+    run_proper_handler(module)
+    run_proper_handler(module)
+    dir_path.rmdir()
+    file_path = dir_path / "file"
+    module = FakeModule(path=file_path, state="file", nested=False)
+    result = run_proper_handler(module)
+    assert result["changed"]
+    assert file_path.is_file()
+
+
 def test_file_deletion(tmp_path):
     file_path = tmp_path / "file"
     module = FakeModule(path=file_path, state="file", nested=False)
@@ -108,6 +200,40 @@ def test_non_existing_deletion(tmp_path):
     assert len(list(tmp_path.iterdir())) == 0
 
 
+def test_remove_file_tolerates_missing_file(tmp_path):
+    assert not remove_file(str(tmp_path / "file"), False)
+
+
+@pytest.mark.parametrize("suffix", ["/child", "/"])
+def test_deletion_below_file_is_noop(tmp_path, suffix):
+    file_path = tmp_path / "file"
+    file_path.touch()
+    module = FakeModule(
+        path=f"{file_path}{suffix}", state="absent", nested=False
+    )
+    result = run_proper_handler(module)
+    assert not result["changed"]
+    assert file_path.is_file()
+
+
+def test_file_creation_below_file_fails(tmp_path):
+    file_path = tmp_path / "file"
+    file_path.touch()
+    module = FakeModule(path=file_path / "child", state="file", nested=False)
+    with pytest.raises(FailException):
+        run_proper_handler(module)
+    assert file_path.is_file()
+
+
+def test_lstat_error_fails(tmp_path):
+    loop = tmp_path / "loop"
+    loop.symlink_to(loop)
+    module = FakeModule(path=loop / "child", state="absent", nested=False)
+    with pytest.raises(FailException):
+        run_proper_handler(module)
+    assert "could not inspect path" in module.exit_kwargs["msg"]
+
+
 def test_nested_file_deletion(tmp_path):
     file_path = tmp_path / "nested1" / "nested2" / "file"
     module = FakeModule(path=file_path, state="file", nested=True)
@@ -116,3 +242,151 @@ def test_nested_file_deletion(tmp_path):
     module = FakeModule(path=file_path, state="absent", nested=False)
     run_proper_handler(module)
     assert len(list(file_path.parent.iterdir())) == 0
+
+
+def test_symlink_rejected(tmp_path):
+    target = tmp_path / "target"
+    target.mkdir()
+    link = tmp_path / "link"
+    link.symlink_to(target)
+    module = FakeModule(path=link, state="absent", nested=False)
+    with pytest.raises(FailException):
+        run_proper_handler(module)
+    assert link.is_symlink()
+    assert target.is_dir()
+
+
+@pytest.mark.parametrize("check_mode", [False, True])
+def test_diff_omitted_when_diff_mode_disabled(tmp_path, check_mode):
+    dir_path = tmp_path / "nested1"
+    module = FakeModule(
+        check_mode=check_mode,
+        diff=False,
+        path=dir_path,
+        state="directory",
+        nested=False,
+    )
+    result = run_proper_handler(module)
+    assert result["changed"]
+    assert "diff" not in result
+
+
+@pytest.mark.parametrize("state", ["file", "directory"])
+def test_check_mode_does_not_create(tmp_path, state):
+    path = tmp_path / "nested1"
+    module = FakeModule(check_mode=True, path=path, state=state, nested=False)
+    result = run_proper_handler(module)
+    assert result["changed"]
+    assert len(list(tmp_path.iterdir())) == 0
+
+
+def test_check_mode_does_not_delete(tmp_path):
+    module = FakeModule(
+        check_mode=True, path=tmp_path, state="absent", nested=False
+    )
+    result = run_proper_handler(module)
+    assert result["changed"]
+    assert tmp_path.is_dir()
+
+
+@pytest.mark.parametrize(
+    "dir_fd_supported, rmtree",
+    [(True, "_fast_rmtree"), (False, "_iter_rmtree")],
+)
+def test_directory_deletion_without_rm(
+    tmp_path, monkeypatch, dir_fd_supported, rmtree
+):
+    dir_path = tmp_path / "nested1"
+    (dir_path / "nested2").mkdir(parents=True)
+    called = []
+    walker = getattr(file_dir, rmtree)
+
+    def spy(path):
+        called.append(path)
+        walker(path)
+
+    monkeypatch.setattr("shutil.which", lambda name: None)
+    monkeypatch.setattr(file_dir, "_DIR_FD_SUPPORTED", dir_fd_supported)
+    monkeypatch.setattr(file_dir, rmtree, spy)
+    module = FakeModule(path=dir_path, state="absent", nested=False)
+    result = run_proper_handler(module)
+    assert result["changed"]
+    assert called == [dir_path]
+    assert len(list(tmp_path.iterdir())) == 0
+
+
+def test_directory_deletion_reports_rm_failure(tmp_path, monkeypatch):
+    rm = tmp_path / "rm"
+    rm.write_text("#!/bin/sh\necho 'rm: cannot remove' >&2\nexit 1\n")
+    rm.chmod(0o755)
+    dir_path = tmp_path / "nested1"
+    dir_path.mkdir()
+    monkeypatch.setattr("shutil.which", lambda name: str(rm))
+    module = FakeModule(path=dir_path, state="absent", nested=False)
+    with pytest.raises(FailException):
+        run_proper_handler(module)
+    assert "rm: cannot remove" in module.exit_kwargs["msg"]
+    assert dir_path.is_dir()
+
+
+def make_tree(tmp_path):
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "keep").touch()
+    root = tmp_path / "root"
+    (root / "nested1" / "nested2").mkdir(parents=True)
+    (root / "file").touch()
+    (root / "nested1" / "nested2" / "file").touch()
+    (root / "nested1" / "link").symlink_to(outside)
+    return root, outside
+
+
+@pytest.mark.parametrize("rmtree", [_iter_rmtree, _fast_rmtree])
+def test_rmtree(tmp_path, rmtree):
+    root, outside = make_tree(tmp_path)
+    rmtree(str(root))
+    assert not root.exists()
+    assert (outside / "keep").exists()
+
+
+def test_fast_rmtree_deeper_than_fd_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_dir, "_MAX_OPEN_DIR_FDS", 2)
+    root, outside = make_tree(tmp_path)
+    _fast_rmtree(str(root))
+    assert not root.exists()
+    assert (outside / "keep").exists()
+
+
+@pytest.mark.parametrize("fail_at", [1, 2])
+def test_fast_rmtree_closes_fds_when_listing_fails(
+    tmp_path, monkeypatch, fail_at
+):
+    root, _ = make_tree(tmp_path)
+    sorted_entries = file_dir._sorted_entries
+    calls = []
+
+    def failing_sorted_entries(directory):
+        calls.append(directory)
+        if len(calls) == fail_at:
+            raise OSError("listing failed")
+        return sorted_entries(directory)
+
+    opened, closed = [], []
+    os_open, os_close = os.open, os.close
+
+    def tracking_open(*args, **kwargs):
+        fd = os_open(*args, **kwargs)
+        opened.append(fd)
+        return fd
+
+    def tracking_close(fd):
+        closed.append(fd)
+        os_close(fd)
+
+    monkeypatch.setattr(file_dir, "_sorted_entries", failing_sorted_entries)
+    monkeypatch.setattr(os, "open", tracking_open)
+    monkeypatch.setattr(os, "close", tracking_close)
+    with pytest.raises(OSError):
+        _fast_rmtree(str(root))
+    assert len(opened) == fail_at
+    assert sorted(closed) == sorted(opened)